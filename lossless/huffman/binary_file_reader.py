@@ -1,75 +1,129 @@
-from bitarray import bitarray
-
-
 class BinaryFileReader:
     """
-    This class helps us read a file bit by bit. It internally uses a bitarray to buffer bits from the file. It first
-    fills the buffer with 8 bits and return bits from that buffer. It won't fill the buffer up again with more data
-    from the file until it is completely consumed.
+    This class helps us read a file a few bits at a time. It buffers bits from the file in a plain
+    int together with a count of how many bits it currently holds, refilling the buffer 8 bytes at
+    a time. Bits are consumed from the most significant end of the buffer, so they come back in the
+    same order they appear in the file.
 
-    The max number of bits stored in the buffer at any given point is 8.
+    Keeping the buffer as an int means reads are just shifts and masks, with no per-call
+    allocations.
     """
 
     def __init__(self, file):
         # Always start at the beginning of the file
         file.seek(0)
         self._file_handler = file
-        # Fill bitarray buffer with first byte from file
         self._end_of_file = False
-        self._buffer = bitarray()
-        self._read_bytes_from_file(self._buffer, 1)
+        self._bit_buffer = 0
+        self._number_buffered_bits = 0
 
     def read_bits(self, number):
         """
-        This method reads N bits from a file and returns them in a bitarray. If the file is already finished,
-        the returned bitarray will be emtpy.
+        This method reads N bits from a file and returns them as an unsigned int where the first
+        bit read is the most significant. If fewer than N bits are left in the file, only the
+        remaining bits are returned (zero once the file is finished).
 
         :param number: The number of bits to read from the file
-        :return: bitarray containing the required bits from the file
+        :return: int containing the required bits from the file
         """
-        bits = bitarray()
-
-        if self._end_of_file:
-            return bits
-
-        # If reading fewer bits that those available, move buffer but don't refill
-        if len(self._buffer) > number:
-            bits.extend(self._buffer[:number])
-            self._buffer = self._buffer[number:]
-        # If reading more bits than those available, keep reading them from file byte by byte and filling
-        # up bitarray to return
-        else:
-            bits.extend(self._buffer)
-            number_missing_bits = number - len(self._buffer)
-            number_whole_missing_bytes = number_missing_bits // 8
-
-            if number_whole_missing_bytes > 0:
-                self._read_bytes_from_file(bits, number_whole_missing_bytes)
-
-            number_final_bits = number_missing_bits % 8
-
-            if number_final_bits > 0:
-                temp_bits = bitarray()
-                self._read_bytes_from_file(temp_bits, 1)
-                bits.extend(temp_bits[:number_final_bits])
-                self._buffer = temp_bits[number_final_bits:]
-            else:
-                self._buffer.clear()
-                self._read_bytes_from_file(self._buffer, 1)
-
-        return bits
-
-    def _read_bytes_from_file(self, bits, number):
-        try:
-            bits.fromfile(self._file_handler, number)
-        except EOFError:
-            self._end_of_file = True
+        # Fast path: the request fits in what is already buffered, so no refill logic runs. This
+        # covers almost every call since the buffer holds up to 64 bits at a time
+        if number > self._number_buffered_bits:
+            self._refill(number)
+            number = min(number, self._number_buffered_bits)
+
+        # Consumed bits are left in the buffer above the count and masked out on extraction;
+        # _refill clears them once per refill instead of every read paying for it
+        self._number_buffered_bits -= number
+
+        return (self._bit_buffer >> self._number_buffered_bits) & ((1 << number) - 1)
+
+    def read_bytes(self, number):
+        """
+        This method reads N bytes from the file and returns them as a bytes object. The bytes do
+        not need to start on a byte boundary of the underlying file.
+
+        :param number: The number of bytes to read from the file
+        :return: bytes object containing the required bytes from the file
+        """
+        return self.read_bits(number * 8).to_bytes(number, 'big')
+
+    def peek_bits(self, number):
+        """
+        This method returns the next N bits of the file as an unsigned int without consuming them.
+        If fewer than N bits are left, the value is padded with zero bits on the right so that it
+        always has N bits.
+
+        :param number: The number of bits to peek from the file
+        :return: int containing the next bits of the file
+        """
+        if number > self._number_buffered_bits:
+            self._refill(number)
+
+        if self._number_buffered_bits >= number:
+            return (self._bit_buffer >> (self._number_buffered_bits - number)) & ((1 << number) - 1)
+
+        return (self._bit_buffer & ((1 << self._number_buffered_bits) - 1)) \
+            << (number - self._number_buffered_bits)
+
+    def skip_bits(self, number):
+        """
+        This method consumes N bits from the buffer without returning them. It is meant to be used
+        together with peek_bits once the caller knows how many of the peeked bits it used.
+
+        :param number: The number of bits to skip
+        """
+        self._number_buffered_bits -= min(number, self._number_buffered_bits)
+
+    @property
+    def buffered_bits(self):
+        """
+        Number of bits currently held in the internal buffer: bits already pulled from the file
+        but not yet consumed by the caller.
+        """
+        return self._number_buffered_bits
+
+    def bits_available(self, number):
+        """
+        This method returns how many bits can still be read from the file, up to the given number.
+
+        :param number: The max number of bits the caller is interested in
+        :return: min(number, number of bits left in the file)
+        """
+        if number <= self._number_buffered_bits:
+            return number
+
+        self._refill(number)
+        return min(number, self._number_buffered_bits)
+
+    def _refill(self, number):
+        # Drop bits consumed since the last refill; reads only mask them out of their return value
+        self._bit_buffer &= (1 << self._number_buffered_bits) - 1
+
+        # Fill the bit buffer 8 bytes at a time until it holds at least the requested number of
+        # bits or the file is finished
+        while self._number_buffered_bits < number and not self._end_of_file:
+            chunk = self._file_handler.read(8)
+
+            if not chunk:
+                self._end_of_file = True
+                break
+
+            self._bit_buffer = (self._bit_buffer << (len(chunk) * 8)) | int.from_bytes(chunk, 'big')
+            self._number_buffered_bits += len(chunk) * 8
 
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self._end_of_file:
-            raise StopIteration
-        else:
-            return self.read_bits(1)
+        # Single-bit reads are the common case when iterating, so pull the bit straight from the
+        # buffer instead of going through bits_available + read_bits
+        if not self._number_buffered_bits:
+            self._refill(1)
+
+            if not self._number_buffered_bits:
+                raise StopIteration
+
+        self._number_buffered_bits -= 1
+
+        return (self._bit_buffer >> self._number_buffered_bits) & 1
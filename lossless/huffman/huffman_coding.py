@@ -1,13 +1,35 @@
 import math
 import argparse
+import logging
+from array import array
 import lossless.huffman.paths as paths
 import time
 
+from collections import Counter
+
 from bitarray import bitarray
+from bitarray.util import ba2int, int2ba
 from lossless.huffman.binary_file_reader import BinaryFileReader
 from lossless.huffman.huffman_map import build_huffman_map
 from lossless.huffman.grouping_file_reader import GroupingFileReader
 
+# Decoding with a compiled kernel is optional: when numba and numpy are installed the content
+# decode loop runs as machine code over the raw file bytes, otherwise the pure Python loop is used
+try:
+    import numpy
+    from numba import njit
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+# Number of bits used to index the prefix lookup table built for decoding. Any code of up to this
+# many bits is resolved with a single table lookup; longer codes fall back to a prefix search
+PREFIX_TABLE_BITS = 11
+
+# Number of decoded characters to buffer before writing them to the output file in one call
+OUTPUT_BUFFER_SIZE = 1 << 20
+
 
 def encode(file_path, output_path, block_size, bits_utf8_block):
     """
@@ -23,17 +45,24 @@ def encode(file_path, output_path, block_size, bits_utf8_block):
     """
     output_path = paths.get_compressed_output_path(file_path, output_path)
 
-    encoding_map = build_huffman_map(_get_symbol_occurrences(file_path, block_size))
+    # A single pass over the input collects the symbol frequencies and materializes the input as
+    # a stream of small int ids, so the file doesn't need to be read a second time for the
+    # encoding below and repeated groups don't keep duplicate strings alive
+    symbol_id_stream, symbol_table, symbol_occurrences = _read_input_file(file_path, block_size)
 
-    print("Huffman codes: {}".format(encoding_map))
+    encoding_map = build_huffman_map(symbol_occurrences)
 
-    encoded_input = bitarray()
+    logger.debug("Huffman codes: %s", encoding_map)
 
-    with open(file_path, 'r') as inputf:
-        grouping_reader = GroupingFileReader(inputf, group_size=block_size)
+    # Re-encode the in-RAM id stream through an id-keyed view of the code map
+    id_encoding_map = {symbol_id: encoding_map[symbol] for symbol, symbol_id in symbol_table.items()}
 
-        for groups in grouping_reader:
-            encoded_input.encode(encoding_map, groups)
+    encoded_input = bitarray()
+
+    # An empty input has no ids at all (the id map is empty too, which bitarray.encode rejects);
+    # the archive is then just the encoding map and the end-of-file marker
+    if symbol_id_stream:
+        encoded_input.encode(id_encoding_map, symbol_id_stream)
 
     # Huffman map is added at the beginning of the encoded file to be able to decode it later
     encoded_content = _encode_huffman_map(encoding_map, bits_utf8_block)
@@ -43,7 +72,12 @@ def encode(file_path, output_path, block_size, bits_utf8_block):
     encoded_content.extend(encoding_map[u"\u001C"])
 
     with open(output_path, 'wb') as outputf:
-        encoded_content.tofile(outputf)
+        # Write the encoded content in large slabs through a memoryview, so no slice copies are
+        # made and each write hands the file a full buffer
+        encoded_bytes = memoryview(encoded_content.tobytes())
+
+        for start in range(0, len(encoded_bytes), OUTPUT_BUFFER_SIZE):
+            outputf.write(encoded_bytes[start:start + OUTPUT_BUFFER_SIZE])
 
 
 def decode(input_path, output_path, bits_utf8_block):
@@ -79,64 +113,237 @@ def decode(input_path, output_path, bits_utf8_block):
         while not is_map_decoding_done:
             is_map_decoding_done = _decode_huffman_map_entry(decoding_map, reader, bits_utf8_block)
 
-        with open(output_path, 'w') as outf:
-            done_decoding = False
+        table, long_codes, max_code_length = _build_decoding_table(decoding_map)
+
+        # A buffer matching the decoded-slab size keeps each flushed slab a single write syscall
+        with open(output_path, 'w', buffering=OUTPUT_BUFFER_SIZE) as outf:
+            # The compiled kernel only handles codes that fit the prefix table; longer codes are
+            # rare and those maps take the Python loop instead
+            if numpy is not None and max_code_length <= PREFIX_TABLE_BITS:
+                _decode_content_compiled(f, reader, decoding_map, outf)
+            else:
+                _decode_content(reader, table, long_codes, max_code_length, outf)
+
+        logger.info("Decoding content time: %s s", time.time() - start_decoding_content)
+
+
+def _decode_content(reader, table, long_codes, max_code_length, outf):
+    symbols = []
+    buffered_length = 0
+    done_decoding = False
+
+    while not done_decoding:
+        # The reader buffers bits internally, so decoding is peek / table lookup / skip. Near the
+        # end of the file fewer bits than the longest code remain and we decode what is left
+        available_bits = reader.bits_available(max_code_length)
+
+        if available_bits == 0:
+            raise ValueError("Could not decode input file")
+
+        # Index the prefix table with the next PREFIX_TABLE_BITS bits. Codes shorter than the
+        # index width occupy every slot sharing their prefix, so a single lookup finds both the
+        # symbol and the number of bits it consumed
+        symbol, code_length = table[reader.peek_bits(PREFIX_TABLE_BITS)]
+
+        # Codes longer than the table width belong to rare symbols; resolve them by
+        # longest-prefix match against the remaining codes
+        if symbol is None:
+            symbol, code_length = _decode_long_code(
+                long_codes, reader.peek_bits(max_code_length), available_bits, max_code_length)
+
+        if code_length > available_bits:
+            raise ValueError("Could not decode input file")
+
+        reader.skip_bits(code_length)
+
+        # It reached end-of-file when it reads SEPARATOR 4
+        if symbol == u"\u001C":
+            done_decoding = True
+        else:
+            symbols.append(symbol)
+            buffered_length += len(symbol)
+
+            # Flush the decoded symbols in large slabs so the output file sees one write per
+            # OUTPUT_BUFFER_SIZE characters instead of one per symbol, and memory use stays
+            # bounded for large files
+            if buffered_length >= OUTPUT_BUFFER_SIZE:
+                outf.write(''.join(symbols))
+                symbols.clear()
+                buffered_length = 0
+
+    outf.write(''.join(symbols))
+
+
+def _decode_content_compiled(input_file, reader, decoding_map, outf):
+    symbols = list(decoding_map)
+    symbol_ids = {symbol: symbol_id for symbol_id, symbol in enumerate(symbols)}
+
+    # Pack the prefix table into an int array of (symbol id << 5) | code length entries, the
+    # layout the kernel works on. Slots left at zero make the kernel report a decoding error
+    packed_table = numpy.zeros(1 << PREFIX_TABLE_BITS, dtype=numpy.int64)
+
+    for symbol, code in decoding_map.items():
+        code_length = len(code)
+        first_slot = ba2int(code) << (PREFIX_TABLE_BITS - code_length)
+        packed_table[first_slot:first_slot + (1 << (PREFIX_TABLE_BITS - code_length))] = \
+            (symbol_ids[symbol] << 5) | code_length
+
+    # The kernel runs over the raw file bytes, starting right after the encoding map (which in
+    # general ends in the middle of a byte)
+    start_bit = input_file.tell() * 8 - reader.buffered_bits
+    input_file.seek(0)
+    data = numpy.frombuffer(input_file.read(), dtype=numpy.uint8)
+
+    decoded_ids, decoding_error = \
+        _decode_symbol_ids(data, packed_table, start_bit, symbol_ids[u"\u001C"])
+
+    if decoding_error:
+        raise ValueError("Could not decode input file")
 
-            while not done_decoding:
-                read_bits = reader.read_bits(50000)
-                read_valid = False
-                number_read_invalid = 0
+    # Map symbol ids back to text through a fancy-indexed object array, flushing in slabs
+    symbol_array = numpy.array(symbols, dtype=object)
 
-                while not read_valid:
-                    try:
-                        # Can raise ValueError if the last symbol read is incomplete. At that point, it
-                        # reads bit by bit until it completes the symbol
-                        symbols = read_bits.decode(decoding_map)
+    for start in range(0, len(decoded_ids), OUTPUT_BUFFER_SIZE):
+        outf.write(''.join(symbol_array[decoded_ids[start:start + OUTPUT_BUFFER_SIZE]].tolist()))
 
-                        # It reached end-of-file when it reads SEPARATOR 4
-                        if symbols[-1] == u"\u001C":
-                            symbols = symbols[:-1]
-                            done_decoding = True
 
-                        outf.write(''.join(symbols))
-                        read_valid = True
-                    except ValueError:
-                        if number_read_invalid == 31:
-                            raise ValueError("Could not decode input file")
+if numpy is not None:
+    @njit(cache=True)
+    def _decode_symbol_ids(data, table, start_bit, eof_id):
+        # Upper bound on the output size: codes are at least one bit each
+        decoded_ids = numpy.empty(data.size * 8 - start_bit, dtype=numpy.int32)
 
-                        number_read_invalid += 1
-                        read_bits.extend(reader.read_bits(1))
+        byte_index = start_bit // 8
+        bit_buffer = 0
+        number_buffered_bits = 0
 
-        print("Decoding content time: {} s".format(time.time() - start_decoding_content))
+        # The encoding map usually ends in the middle of a byte; load the tail of that byte first
+        if start_bit % 8:
+            bit_buffer = data[byte_index] & ((1 << (8 - start_bit % 8)) - 1)
+            number_buffered_bits = 8 - start_bit % 8
+            byte_index += 1
+
+        number_decoded = 0
+
+        while True:
+            while number_buffered_bits < PREFIX_TABLE_BITS and byte_index < data.size:
+                bit_buffer = (bit_buffer << 8) | data[byte_index]
+                number_buffered_bits += 8
+                byte_index += 1
+
+            if number_buffered_bits >= PREFIX_TABLE_BITS:
+                index = bit_buffer >> (number_buffered_bits - PREFIX_TABLE_BITS)
+            else:
+                index = bit_buffer << (PREFIX_TABLE_BITS - number_buffered_bits)
+
+            packed = table[index & ((1 << PREFIX_TABLE_BITS) - 1)]
+            code_length = packed & 31
+
+            if code_length == 0 or code_length > number_buffered_bits:
+                return decoded_ids[:number_decoded], True
+
+            number_buffered_bits -= code_length
+            bit_buffer &= (1 << number_buffered_bits) - 1
+
+            symbol_id = packed >> 5
+
+            # It reached end-of-file when it reads SEPARATOR 4
+            if symbol_id == eof_id:
+                return decoded_ids[:number_decoded], False
+
+            decoded_ids[number_decoded] = symbol_id
+            number_decoded += 1
 
 
 # Returns true if we it is done reading the encoding map. This happens when the entry read is unicode SEPARATOR 3
 def _decode_huffman_map_entry(decoding_map, reader, bits_utf8_block):
-    utf8_symbol_number_bytes = int(reader.read_bits(bits_utf8_block).to01(), 2)
+    utf8_symbol_number_bytes = reader.read_bits(bits_utf8_block)
 
     # Reading necessary bytes to decode UTF-8 symbol
-    utf8_symbol_binary = reader.read_bits(utf8_symbol_number_bytes * 8)
-    utf8_symbol = utf8_symbol_binary.tobytes().decode('utf-8')
+    utf8_symbol = reader.read_bytes(utf8_symbol_number_bytes).decode('utf-8')
 
     # If symbol is SEPARATOR 3, then it reached the end of the map
     if utf8_symbol == u"\u001D":
-        print("Done reading encoding map")
+        logger.debug("Done reading encoding map")
         return True
 
     # Five bits indicating the number of bits in the Huffman code associated with the symbol
-    encoding_number_bits = int(reader.read_bits(5).to01(), 2)
+    encoding_number_bits = reader.read_bits(5)
 
     # Reading Huffman code
-    encoding_bits = reader.read_bits(encoding_number_bits)
+    encoding_bits = int2ba(reader.read_bits(encoding_number_bits), length=encoding_number_bits)
 
-    print('Decoded map entry {} -> {} with UTF-8 character bits {}'
-          .format(encoding_bits.to01(), utf8_symbol, utf8_symbol_binary.to01()))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Decoded map entry %s -> %s', encoding_bits.to01(), utf8_symbol)
 
     decoding_map[utf8_symbol] = encoding_bits
 
     return False
 
 
+def _build_decoding_table(decoding_map):
+    """
+    Builds a flat prefix lookup table from a map of symbols to Huffman codes. The table has one slot
+    per possible PREFIX_TABLE_BITS-bit pattern, and every slot whose prefix matches a code holds the
+    (symbol, code length) pair for it. This lets the decoder consume a whole code per lookup instead
+    of checking the map after every single bit.
+
+    Codes longer than PREFIX_TABLE_BITS mark their slots with (None, 0) and are resolved separately
+    through the returned trie, a nested dict keyed by bit value whose leaves hold the symbol.
+
+    :param decoding_map: Map of symbols to Huffman codes (bitarray)
+    :return: Tuple with the lookup table, the trie of long codes and the max code length
+    """
+    table = [(None, 0)] * (1 << PREFIX_TABLE_BITS)
+    long_codes = {}
+    max_code_length = max(len(code) for code in decoding_map.values())
+
+    for symbol, code in decoding_map.items():
+        code_length = len(code)
+
+        if code_length <= PREFIX_TABLE_BITS:
+            # Fill every table slot that starts with this code. There are 2^(PREFIX_TABLE_BITS - L)
+            # of them, all sharing the code as prefix
+            first_slot = ba2int(code) << (PREFIX_TABLE_BITS - code_length)
+            entry = (symbol, code_length)
+
+            for slot in range(first_slot, first_slot + (1 << (PREFIX_TABLE_BITS - code_length))):
+                table[slot] = entry
+        else:
+            # Long codes go into small tries walked one bit at a time, grouped by their first
+            # PREFIX_TABLE_BITS bits — the same value that missed in the table — so resolving one
+            # skips straight past the bits the table lookup already matched
+            node = long_codes.setdefault(ba2int(code[:PREFIX_TABLE_BITS]), {})
+            for bit in code[PREFIX_TABLE_BITS:-1]:
+                node = node.setdefault(bit, {})
+            node[code[-1]] = symbol
+
+    return table, long_codes, max_code_length
+
+
+# Resolves a code longer than PREFIX_TABLE_BITS by walking the trie for its table prefix one bit
+# at a time, starting right after the bits the table lookup already matched. The window holds the
+# next max_code_length bits of the file; only the first available_bits of it are valid. Raises
+# ValueError when no code matches
+def _decode_long_code(long_codes, window, available_bits, max_code_length):
+    if available_bits < PREFIX_TABLE_BITS:
+        raise ValueError("Could not decode input file")
+
+    node = long_codes.get(window >> (max_code_length - PREFIX_TABLE_BITS))
+
+    for code_length in range(PREFIX_TABLE_BITS + 1, min(available_bits, max_code_length) + 1):
+        if node is None:
+            break
+
+        node = node.get((window >> (max_code_length - code_length)) & 1)
+
+        # Leaves hold the decoded symbol; inner nodes are dicts
+        if node is not None and not isinstance(node, dict):
+            return node, code_length
+
+    raise ValueError("Could not decode input file")
+
+
 def _encode_huffman_map(encoding_map, bits_utf8_block):
     encoded_map = bitarray()
 
@@ -148,7 +355,7 @@ def _encode_huffman_map(encoding_map, bits_utf8_block):
     encoded_map.extend("0" * (bits_utf8_block - 1) + "1")
     encoded_map.frombytes(bytes(u"\u001D", 'utf-8'))
 
-    print("Encoded map length: {}".format(len(encoded_map)))
+    logger.debug("Encoded map length: %d", len(encoded_map))
 
     return encoded_map
 
@@ -166,30 +373,43 @@ def _encode_huffman_map_entry(symbol, code, bytes_utf8_block):
     encoded_entry.extend('{0:05b}'.format(number_bits_code))
     encoded_entry.extend(code)
 
-    print("Total encoded entry {} -> {} : {} with {} code bits"
-          .format(symbol, code, encoded_entry, number_bits_code))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Total encoded entry %s -> %s : %s with %d code bits",
+                     symbol, code, encoded_entry, number_bits_code)
 
     return encoded_entry
 
 
-def _get_symbol_occurrences(file_path, block_size):
-    symbol_occurrences = {}
+def _read_input_file(file_path, block_size):
+    # Counter.update runs the per-symbol counting in C instead of one Python dict update per
+    # symbol. Counting stays on text symbols rather than raw bytes so multi-byte UTF-8 characters
+    # land in the right groups. The input itself is kept as a stream of int ids — one unique
+    # string per distinct group plus a compact int array — so the encoding pass doesn't have to
+    # read the file again and memory doesn't grow with one string object per group
+    symbol_table = {}
+    symbol_id_stream = array('i')
+    symbol_occurrences = Counter()
 
     with open(file_path, 'r') as f:
         grouping_reader = GroupingFileReader(f, group_size=block_size)
 
         for groups in grouping_reader:
-            for symbol in groups:
-                symbol_occurrences[symbol] = \
-                    symbol_occurrences[symbol] + 1 if symbol in symbol_occurrences else 1
+            symbol_occurrences.update(groups)
+
+            # Assign ids to any symbols first seen in this chunk, then convert the whole chunk
+            # with map(), which runs in C
+            for symbol in symbol_occurrences.keys() - symbol_table.keys():
+                symbol_table[symbol] = len(symbol_table)
+
+            symbol_id_stream.extend(map(symbol_table.__getitem__, groups))
 
     # Adding special symbol (unicode separator 4) that will be used to indicate the end of encoded file
     symbol_occurrences[u"\u001C"] = 1
 
-    print("Symbol occurrences: {}. Total number of symbols: {}"
-          .format(symbol_occurrences, len(symbol_occurrences)))
+    logger.debug("Symbol occurrences: %s. Total number of symbols: %d",
+                 symbol_occurrences, len(symbol_occurrences))
 
-    return symbol_occurrences
+    return symbol_id_stream, symbol_table, symbol_occurrences
 
 
 if __name__ == "__main__":
@@ -231,6 +451,8 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO)
+
     # The number of bits needed to represent the number of UTF-8 bytes depends on the block size. Also the max number
     # of bytes per UTF-8 character is 4. For example, if our blocks consists of 3 characters, that means we need a max
     # of 3 * 4 = 12 characters to represent a block. The number of bits we need to represent a 12 is ceil(log(12)) = 4.
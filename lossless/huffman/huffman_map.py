@@ -1,5 +1,6 @@
 import heapq
 from bitarray import bitarray
+from bitarray.util import int2ba
 
 
 def build_huffman_map(symbol_occurrences):
@@ -20,93 +21,70 @@ def build_huffman_map(symbol_occurrences):
 
     For more info: https://en.wikipedia.org/wiki/Huffman_coding
 
+    The tree is kept as parallel arrays instead of node objects: node i has weights[i] and child
+    indexes zero_children[i] / one_children[i] (-1 for leaves). Leaves are nodes 0..N-1 in symbol
+    order and merged nodes are appended after them, so building the tree allocates no objects and
+    the heap only ever compares (weight, node index) int tuples.
+
     :param symbol_occurrences: Map of symbols to frequencies that we want to find Huffman codes for
     :return: Map of symbols to Huffman codes
     """
-    initial_huffman_nodes = \
-        [HuffmanTreeNode(symbol, occurrences) for symbol, occurrences in symbol_occurrences.items()]
+    symbols = list(symbol_occurrences)
 
-    huffman_tree_root = _build_huffman_tree(initial_huffman_nodes)
+    weights = list(symbol_occurrences.values())
+    zero_children = [-1] * len(symbols)
+    one_children = [-1] * len(symbols)
 
-    encoding_map = {}
-    _build_huffman_map(huffman_tree_root, encoding_map)
-    return encoding_map
+    root = _build_huffman_tree(weights, zero_children, one_children)
+
+    return _build_huffman_map(root, symbols, zero_children, one_children)
 
 
 # Traverse binary Huffman tree appending 0 when we go left and 1 when we go right to the current huffman
 # code constructed. Once we get to a leaf, the construction of the current code is done and we can add it to
 # the Huffman map.
-def _build_huffman_map(huffman_tree_root, encoding_map, bits=""):
-    if not huffman_tree_root.zero_child and not huffman_tree_root.one_child:
-        encoding_map[huffman_tree_root.input_symbol] = bitarray(bits)
-    else:
-        _build_huffman_map(huffman_tree_root.zero_child, encoding_map, bits + "0")
-        _build_huffman_map(huffman_tree_root.one_child, encoding_map, bits + "1")
-
-
-def _build_huffman_tree(huffman_tree_nodes):
-    heapq.heapify(huffman_tree_nodes)
-
-    while len(huffman_tree_nodes) > 1:
-        # Remove the two nodes with lowest frequency from the priority queue and combine them into a single node
-        min_1 = heapq.heappop(huffman_tree_nodes)
-        min_2 = heapq.heappop(huffman_tree_nodes)
-
-        # The combined priority queue node contains an internal tree with:
-        #   - Root: Te combined symbol and frequency from the two extracted nodes
-        #   - Children: Each of the nodes with lowest frequency that we extracted
-        combined_node = HuffmanTreeNode(
-            "{}{}".format(min_1.input_symbol, min_2.input_symbol),
-            min_1.symbol_weight + min_2.symbol_weight,
-            zero_child=min_1,
-            one_child=min_2
-        )
-
-        # Add the new combined node to the priority queue
-        heapq.heappush(huffman_tree_nodes, combined_node)
-
-    # At the end, there is a single node in the priority queue containing the whole Huffman tree inside
-    return huffman_tree_nodes[0]
-
+#
+# The traversal is done with an explicit stack carrying the code built so far as an (int, length)
+# pair, so no intermediate strings are allocated and deep trees don't hit the recursion limit. The
+# final bitarray is only built once per leaf.
+def _build_huffman_map(root, symbols, zero_children, one_children):
+    encoding_map = {}
+    stack = [(root, 0, 0)]
 
-class HuffmanTreeNode:
-    def __init__(self, input_symbol, symbol_weight, zero_child=None, one_child=None):
-        self._input_symbol = input_symbol
-        self._symbol_weight = symbol_weight
-        self._zero_child = zero_child
-        self._one_child = one_child
+    while stack:
+        node, code, code_length = stack.pop()
+        zero_child = zero_children[node]
 
-    @property
-    def input_symbol(self):
-        return self._input_symbol
+        if zero_child < 0:
+            encoding_map[symbols[node]] = \
+                int2ba(code, length=code_length) if code_length else bitarray()
+        else:
+            stack.append((one_children[node], (code << 1) | 1, code_length + 1))
+            stack.append((zero_child, code << 1, code_length + 1))
 
-    @property
-    def symbol_weight(self):
-        return self._symbol_weight
+    return encoding_map
 
-    @property
-    def zero_child(self):
-        return self._zero_child
 
-    @property
-    def one_child(self):
-        return self._one_child
+# Builds the Huffman tree over the parallel arrays, appending one merged node per iteration, and
+# returns the index of the root node. The node index doubles as the heap tie breaker: it is unique,
+# so comparisons stay on plain ints and the merge order is deterministic
+def _build_huffman_tree(weights, zero_children, one_children):
+    heap = [(weight, node) for node, weight in enumerate(weights)]
+    heapq.heapify(heap)
 
-    @zero_child.setter
-    def zero_child(self, node):
-        self._zero_child = node
+    while len(heap) > 1:
+        # Remove the two nodes with lowest frequency from the priority queue and combine them into a single node
+        weight_1, min_1 = heapq.heappop(heap)
+        weight_2, min_2 = heapq.heappop(heap)
 
-    @one_child.setter
-    def one_child(self, node):
-        self._one_child = node
+        # The combined node is an internal tree node with the combined frequency from the two
+        # extracted nodes as children. Only leaves carry an input symbol
+        weights.append(weight_1 + weight_2)
+        zero_children.append(min_1)
+        one_children.append(min_2)
 
-    def __lt__(self, other):
-        return self._symbol_weight < other.symbol_weight
+        # Add the new combined node to the priority queue
+        heapq.heappush(heap, (weight_1 + weight_2, len(weights) - 1))
 
-    def __str__(self):
-        return "{}:{}:{}:{}".format(
-            self._input_symbol,
-            self._symbol_weight,
-            self._zero_child.input_symbol if self._zero_child else "None",
-            self._one_child.input_symbol if self._one_child else "None"
-        )
\ No newline at end of file
+    # At the end, there is a single node in the priority queue pointing at the root of the tree
+    return heap[0][1]